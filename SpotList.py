@@ -1,21 +1,53 @@
+import asyncio
 import logging
+import secrets
 import time
 import uuid
+from contextlib import asynccontextmanager
 from typing import Annotated
 
 import requests
-from fastapi import FastAPI, HTTPException, Header, status, Query, Path, Body
+from fastapi import FastAPI, HTTPException, Header, status, Query, Path, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
+import admission
 import cfg
+import markets
 import models
+import profiling
+import typeahead
+from snapshot import ALBUM_GROUPS, Snapshot
 from user import User, AuthorizationException
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Commit deferred database writes once per flush window. This runs on the event loop, as the sqlite connection can
+    # only be used from the thread that created it.
+    def flush():
+        # A failed flush must not stop the loop, or nothing would be committed until the server restarts
+        try:
+            cfg.writes.flush()
+        except Exception:
+            logging.exception("failed to flush deferred database writes")
+
+    async def flush_writes():
+        while True:
+            await asyncio.sleep(cfg.write_flush_interval)
+            flush()
+
+    flusher = asyncio.create_task(flush_writes())
+    yield
+    flusher.cancel()
+    flush()
+
+
 app = FastAPI(
     title="SpotList API",
     description="Allows users to crate automated playlists based on rulesets",
-    version="v0.0.1"
+    version="v0.0.1",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -26,6 +58,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(profiling.ProfilingMiddleware)
+
+
+async def admin_only(admin_token: Annotated[str | None, Header(description="Token for the admin endpoints.")] = None):
+    # Admin endpoints are disabled entirely if no admin token is configured
+    if cfg.admin_token is None or admin_token is None or not secrets.compare_digest(admin_token, cfg.admin_token):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "admin token missing or incorrect")
+
 
 # Return an HTTP 401 code if login fails
 @app.exception_handler(AuthorizationException)
@@ -50,38 +90,70 @@ async def http_exception_handler(request, exception: requests.HTTPError):
 
 @app.get("/search", status_code=status.HTTP_200_OK, response_model=models.SearchResult, name="Search Spotify for a object")
 async def search(
-        user_id: Annotated[str, Header(title="User ID", description="User ID of the active user.")],
-        token: Annotated[str, Header(description="Token of the active user.")],
+        user: Annotated[User, Depends(admission.limit("search"))],
         types: Annotated[list[models.SearchType], Query(description="List of item types to search across.")],
         query: Annotated[str, Query(description="Search query.")],
         limit: Annotated[int, Query(ge=0, le=50, description="The maximum number of results to return.")] = 20,
-        offset: Annotated[int, Query(ge=0, le=1000, description="The index of the first result to return. Use with `limit` to get the next page of search results.")] = 0
+        offset: Annotated[int, Query(ge=0, le=1000, description="The index of the first result to return. Use with `limit` to get the next page of search results.")] = 0,
+        market: Annotated[str | None, Query(pattern="^[A-Za-z]{2}$", description="ISO 3166-1 alpha-2 country code. If given, tracks and albums that can't be played in this market are left out.")] = None
         ):
-    user = User(user_id, token)
-    request = user.get("/search", params={"type": types, "q": query, "limit": limit, "offset": offset})
-    return models.SearchResult.from_raw(request)
-
-
-@app.post("/temp/from_artist", status_code=status.HTTP_201_CREATED, name="Create a playlist of an artist's songs")
-async def temp_create_artist_playlist(
+    # Call Spotify from a separate thread, so the event loop can keep serving (and admitting) other requests meanwhile.
+    # The token has to be refreshed here first, as the database can't be used from that thread.
+    user.refresh_if_expired(margin=60)
+    request = await asyncio.to_thread(
+            user.get, "/search", params={"type": types, "q": query, "limit": limit, "offset": offset}
+            )
+    result = models.SearchResult.from_raw(request)
+    return result.available_in(market) if market else result
+
+
+# Typeahead takes its admission slot itself, once the debounce delay is over. Requests that get superseded while waiting
+# it out never call Spotify, so they shouldn't count against the user's limit.
+@app.get("/search/typeahead", status_code=status.HTTP_200_OK, response_model=list[models.TypeaheadItem], name="Search Spotify as the user types")
+async def search_typeahead(
         user_id: Annotated[str, Header(title="User ID", description="User ID of the active user.")],
         token: Annotated[str, Header(description="Token of the active user.")],
-        artist_id: Annotated[str, Query(description="Spotify ID of the artist to use to create the playlist")],
-        name: Annotated[str, Body(description="The name for the new playlist. Does *not* need to be unique.")],
-        public: Annotated[bool, Body(description="Determines if the playlist is public or private. Defaults to private.")] = False,
-        description: Annotated[str, Body(description="Description of the playlist, as seen in Spotify.")] = None
+        types: Annotated[list[models.SearchType], Query(description="List of item types to search across.")],
+        query: Annotated[str, Query(min_length=1, description="Search query, as typed so far.")],
+        limit: Annotated[int, Query(ge=1, le=50, description="The maximum number of results to return for each type.")] = 5
         ):
     user = User(user_id, token)
-
-    albums: list[str] = []
-    request = user.get(f"/artists/{artist_id}/albums", {"limit": 50})
-
-    while True:
-        albums += (i["id"] for i in request["items"])
-        if not request["next"]: break
-        request = user.get(request["next"], raw_url=True)
-
-    songs: list[str] = []
+    return await typeahead.search(user, types, query, limit)
+
+
+def update_artist_snapshot(user: User, artist_id: str, snapshot: Snapshot) -> None:
+    """
+    Bring the snapshot of an artist's playlist up to date with the albums Spotify currently lists for the artist,
+    fetching the tracks of new albums only
+    :param user: The user to make the API calls as
+    :param artist_id: Spotify ID of the artist
+    :param snapshot: Snapshot of the last build of the artist. Is updated in place.
+    """
+    for group in ALBUM_GROUPS:
+        known = snapshot.groups.get(group, [])
+        known_ids = set(known)
+        listing: list[str] = []
+        request = user.get(f"/artists/{artist_id}/albums", {"include_groups": group, "limit": 50})
+
+        while True:
+            ids = [i["id"] for i in request["items"]]
+            # Within a group Spotify lists the newest albums first, so once we reach an album from the snapshot, the
+            # rest of the group should be the same as in the snapshot. If the count doesn't add up, albums were delisted
+            # or moved, so page through the whole group instead.
+            first_known = next((n for n, i in enumerate(ids) if i in known_ids), None)
+            if first_known is not None:
+                rest = known[known.index(ids[first_known]):]
+                if len(listing) + first_known + len(rest) == request["total"]:
+                    listing += ids[:first_known] + rest
+                    break
+                known_ids = set()
+            listing += ids
+            if not request["next"]: break
+            request = user.get(request["next"], raw_url=True)
+
+        snapshot.set_group(group, listing)
+
+    albums = [i for i in snapshot.albums if i not in snapshot.tracks]
 
     # Spotify's /albums endpoint only supports getting details for 20 albums at a time, so we need to split the list of
     # albums into chunks of 20 and do an API call for each chunk
@@ -89,14 +161,31 @@ async def temp_create_artist_playlist(
         # the ids parameter requires comma seperated ids, so we need to run the list through .join
         request = user.get("/albums", {"ids": ",".join(albums[offset:offset+20])})
         for album in request['albums']:
-            tracks = album['tracks']
+            album_tracks = snapshot.tracks.setdefault(album['id'], [])
+            items = album['tracks']
             while True:
                 # If an artist guest stars on one track on an album, every song on the album will be gathered by
                 # /albums, so we need to check every track to make sure that the target artist preformed on the track.
-                songs += (i['uri'] for i in tracks['items'] if any(artist_id == j['id'] for j in i['artists']))
-                if not tracks["next"]: break
-                tracks = user.get(tracks["next"], raw_url=True)
-
+                album_tracks += ((i['uri'], markets.mask(i.get('available_markets')))
+                                 for i in items['items'] if any(artist_id == j['id'] for j in i['artists']))
+                if not items["next"]: break
+                items = user.get(items["next"], raw_url=True)
+
+    # Spotify returns `null` for albums it can't find. Record them as empty, so we don't keep asking for them.
+    for album in albums:
+        snapshot.tracks.setdefault(album, [])
+
+
+def push_playlist(user: User, name: str, public: bool, description: str | None, songs: list[str]) -> str:
+    """
+    Create a playlist in the user's Spotify account and add a tracklist to it
+    :param user: The user to create the playlist for
+    :param name: The name for the new playlist
+    :param public: Determines if the playlist is public or private
+    :param description: Description of the playlist, as seen in Spotify
+    :param songs: URIs of the tracks to add, in order
+    :return: The URL of the new playlist
+    """
     body = {"name": name, "public": public, "description": description}
     request = user.post(f"/users/{user.spotify_id}/playlists", body=body)
 
@@ -110,6 +199,35 @@ async def temp_create_artist_playlist(
     return playlist_url
 
 
+@app.post("/temp/from_artist", status_code=status.HTTP_201_CREATED, name="Create a playlist of an artist's songs")
+async def temp_create_artist_playlist(
+        user: Annotated[User, Depends(admission.limit("build"))],
+        artist_id: Annotated[str, Query(description="Spotify ID of the artist to use to create the playlist")],
+        name: Annotated[str, Body(description="The name for the new playlist. Does *not* need to be unique.")],
+        public: Annotated[bool, Body(description="Determines if the playlist is public or private. Defaults to private.")] = False,
+        description: Annotated[str, Body(description="Description of the playlist, as seen in Spotify.")] = None,
+        market: Annotated[str | None, Query(pattern="^[A-Za-z]{2}$", description="ISO 3166-1 alpha-2 country code. If given, only tracks that can be played in this market are added.")] = None,
+        rebuild: Annotated[bool, Query(description="If true, ignore the snapshot of the last build and fetch every album again.")] = False
+        ):
+    # The Spotify calls run on separate threads, so the event loop can keep serving (and admitting) other requests
+    # meanwhile. Everything that uses the database stays on the event loop, including refreshing the token - with
+    # enough margin that it won't expire partway through the build.
+    user.refresh_if_expired(margin=300)
+
+    # Start from the snapshot of the last build of this artist, so we only need to fetch albums released since then.
+    snapshot = None if rebuild else Snapshot.load(f"artist:{artist_id}")
+    if not snapshot:
+        snapshot = Snapshot(f"artist:{artist_id}")
+
+    await asyncio.to_thread(update_artist_snapshot, user, artist_id, snapshot)
+    snapshot.save()
+
+    # Filter the whole tracklist against the market in one pass, using the availability mask saved for every track
+    songs = snapshot.uris(market)
+
+    return await asyncio.to_thread(push_playlist, user, name, public, description, songs)
+
+
 @app.get("/playlists", status_code=status.HTTP_200_OK, name="get list of a user's playlists")
 async def get_playlists(
         user_id: Annotated[str, Header(title="User ID", description="User ID of the active user.")],
@@ -173,14 +291,46 @@ async def set_playlist_rules(
 
 @app.put("/build/{playlist_id}", status_code=status.HTTP_201_CREATED, name="Compile a playlist and push to spotify")
 async def build_playlist(
-        user_id: Annotated[str, Header(title="User ID", description="User ID of the active user.")],
-        token: Annotated[str, Header(description="Token of the active user.")],
+        user: Annotated[User, Depends(admission.limit("build"))],
         playlist_id: Annotated[str, Path(description="ID of the playlist to build")]
         ):
-    user = User(user_id, token)
     return HTTPException(status.HTTP_501_NOT_IMPLEMENTED)
 
 
+@app.get("/admin/admission", status_code=status.HTTP_200_OK, response_model=dict[str, models.AdmissionStats], name="Get admission control metrics for each route class",
+         dependencies=[Depends(admin_only)])
+async def get_admission_stats():
+    return {name: controller.stats() for name, controller in admission.controllers.items()}
+
+
+@app.post("/admin/profile", status_code=status.HTTP_204_NO_CONTENT, name="Start profiling live requests",
+          dependencies=[Depends(admin_only)])
+async def start_profiling(
+        mode: Annotated[profiling.ProfileMode, Body(description="`sample` for sampled CPU stacks, `cprofile` for a pstats file, or `tracemalloc` for memory allocations.")],
+        route: Annotated[str | None, Body(description="Only profile requests whose path starts with this. Profiles every route if `null`.")] = None,
+        fraction: Annotated[float, Body(gt=0, le=1, description="Fraction of matching requests to profile.")] = 1,
+        interval: Annotated[float, Body(gt=0, le=1, description="Seconds between stack samples in `sample` mode.")] = 0.005
+        ):
+    profiling.start(mode, route, fraction, interval)
+
+
+@app.delete("/admin/profile", status_code=status.HTTP_204_NO_CONTENT, name="Stop profiling live requests",
+            dependencies=[Depends(admin_only)])
+async def stop_profiling():
+    profiling.stop()
+
+
+@app.get("/admin/profile", status_code=status.HTTP_200_OK, name="Export the results of the current or last profiling session",
+         dependencies=[Depends(admin_only)])
+async def export_profile():
+    if profiling.last is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "no profiling session has been started")
+    if profiling.last.mode == profiling.ProfileMode.cprofile:
+        return Response(profiling.last.export(), media_type="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="SpotList.pstats"'})
+    return Response(profiling.last.export(), media_type="text/plain")
+
+
 @app.get("/auth", status_code=status.HTTP_303_SEE_OTHER, name="Get a Spotify authorization URL to create a user")
 async def get_auth_link():
     # Use our credentials to get the authorization url from Spotify
@@ -221,7 +371,9 @@ async def get_token(
     response.raise_for_status()
     user_data = response.json()
 
-    cfg.db.execute(f"""
+    # The user can't log in without this row, so it is committed immediately instead of waiting for a flush
+    cfg.writes.commit(
+        """
         INSERT INTO users
             (spotify_id, 
              display_name,
@@ -229,15 +381,14 @@ async def get_token(
              refresh_token, 
              expires_at, 
              app_password)
-        VALUES 
-            ('{user_data['id']}', 
-             '{user_data['display_name']}',
-             '{user_auth['access_token']}', 
-             '{user_auth['refresh_token']}', 
-             '{user_auth['expires_in'] + time.time()}',
-             '{state}')
-        """)
-
-    cfg.db.commit()
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (user_data['id'],
+         user_data['display_name'],
+         user_auth['access_token'],
+         user_auth['refresh_token'],
+         user_auth['expires_in'] + time.time(),
+         state)
+        )
 
     return models.Auth(user_id=user_data['id'], token=state, display_name=user_data['display_name'])
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Annotated
+
+from fastapi import HTTPException, Header, status
+
+import cfg
+import models
+from user import User
+
+
+class AdmissionController:
+    """
+    Limits how many requests of one class (e.g. searches or playlist builds) can run at once, both per user and across
+    all users. Requests over the global limit wait in a bounded queue; anything that can't be admitted is rejected
+    immediately instead of piling up.
+    """
+    name: str
+    per_user: int
+    global_limit: int
+    queue_size: int
+    timeout: float
+    retry_after: int
+
+    def __init__(self, name: str, per_user: int, global_limit: int, queue_size: int, timeout: float,
+                 retry_after: int) -> None:
+        """
+        :param name: Name of the route class, used in logs and metrics
+        :param per_user: Number of requests a single user may have running or waiting at once
+        :param global_limit: Number of requests that may run at once across all users
+        :param queue_size: Number of requests that may wait for a free slot at once
+        :param timeout: Seconds a request may wait for a free slot before being rejected
+        :param retry_after: Seconds to tell rejected clients to wait before retrying
+        """
+        self.name = name
+        self.per_user = per_user
+        self.global_limit = global_limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.users: dict[str, int] = defaultdict(int)
+        self.slot_freed = asyncio.Condition()
+
+        self.admitted = 0
+        self.rejected_user = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    def reject(self, code: int, reason: str, user_id: str) -> HTTPException:
+        logging.warning(f"rejected {self.name} request from {user_id}: {reason}")
+        return HTTPException(code, reason, headers={"Retry-After": str(self.retry_after)})
+
+    async def acquire(self, user_id: str) -> None:
+        """
+        Wait for a free slot. Raises a `HTTPException` with a 429 code if the user is over their limit, or a 503 code if
+        the queue is full or no slot is freed in time.
+        :param user_id: ID of the user making the request
+        """
+        # Requests waiting in the queue count against the user as well, so one user can't fill the queue by themselves
+        if self.users.get(user_id, 0) >= self.per_user:
+            self.rejected_user += 1
+            raise self.reject(status.HTTP_429_TOO_MANY_REQUESTS, f"too many concurrent {self.name} requests", user_id)
+
+        if self.in_flight >= self.global_limit and self.waiting >= self.queue_size:
+            self.rejected_queue_full += 1
+            raise self.reject(status.HTTP_503_SERVICE_UNAVAILABLE, f"too many {self.name} requests queued", user_id)
+
+        self.users[user_id] += 1
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            async with self.slot_freed:
+                await asyncio.wait_for(self.slot_freed.wait_for(lambda: self.in_flight < self.global_limit),
+                                       self.timeout)
+                self.in_flight += 1
+        except asyncio.TimeoutError:
+            self.release_user(user_id)
+            self.rejected_timeout += 1
+            raise self.reject(status.HTTP_503_SERVICE_UNAVAILABLE, f"timed out waiting to start {self.name} request",
+                              user_id)
+        except BaseException:
+            self.release_user(user_id)
+            raise
+        finally:
+            self.waiting -= 1
+
+        queue_time = time.perf_counter() - start
+        self.admitted += 1
+        self.queue_time_total += queue_time
+        self.queue_time_max = max(self.queue_time_max, queue_time)
+
+    async def release(self, user_id: str) -> None:
+        """
+        Free the slot taken by `acquire`
+        :param user_id: ID of the user making the request
+        """
+        self.release_user(user_id)
+        async with self.slot_freed:
+            self.in_flight -= 1
+            self.slot_freed.notify_all()
+
+    def release_user(self, user_id: str) -> None:
+        self.users[user_id] -= 1
+        if not self.users[user_id]:
+            del self.users[user_id]
+
+    def stats(self) -> models.AdmissionStats:
+        return models.AdmissionStats(
+                in_flight=self.in_flight,
+                waiting=self.waiting,
+                admitted=self.admitted,
+                rejected_user=self.rejected_user,
+                rejected_queue_full=self.rejected_queue_full,
+                rejected_timeout=self.rejected_timeout,
+                queue_time_total=self.queue_time_total,
+                queue_time_max=self.queue_time_max
+                )
+
+
+controllers = {name: AdmissionController(name, **limits) for name, limits in cfg.admission.items()}
+
+
+def limit(route_class: str):
+    """
+    Create a dependency that logs the user in and holds a slot of a route class for as long as the request runs. Use
+    with `Depends`; the dependency's value is the logged in `User`.
+    :param route_class: Name of the route class in the `admission` section of the config file
+    """
+    controller = controllers[route_class]
+
+    async def dependency(user_id: Annotated[str, Header(title="User ID", description="User ID of the active user.")],
+                         token: Annotated[str, Header(description="Token of the active user.")]):
+        # Log the user in before taking a slot, so a request with someone else's user ID can't use up their slots
+        user = User(user_id, token)
+        await controller.acquire(user.spotify_id)
+        try:
+            yield user
+        finally:
+            await controller.release(user.spotify_id)
+
+    return dependency
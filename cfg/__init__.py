@@ -4,6 +4,8 @@ from pathlib import Path
 
 import yaml
 
+from writes import WriteBehind
+
 # ID and Secret to communicate to Spotify's API with
 client_id: str
 client_secret: str
@@ -12,12 +14,27 @@ client_secret: str
 redirect_uri: int
 db: sqlite3.Connection
 
+# Groups non-critical writes to `db` into one transaction per flush window
+writes: WriteBehind
+
+# Seconds between commits of deferred writes
+write_flush_interval: float
+
+# Token that must be passed in the `admin-token` header to use the admin endpoints. `None` if admin endpoints are off.
+admin_token: str | None
+
 # Base64 encoded client id and secret. Used to refresh a user's access token.
 auth_header: str
 
 # Domains to allow CORS requests from
 cors_urls: list[str]
 
+# Concurrency limits for each class of expensive routes. See `admission.AdmissionController` for the meaning of each key.
+admission: dict[str, dict]
+
+# Settings for the typeahead search endpoint: `debounce`, `cache_size` and `cache_ttl`
+typeahead: dict
+
 # Spotify authorization url, for authenticating users
 auth_url = "https://accounts.spotify.com"
 
@@ -40,17 +57,27 @@ def __setup__(config_file: Path) -> None:
     global client_secret
     global redirect_uri
     global db
+    global writes
+    global write_flush_interval
     global auth_header
+    global admin_token
     global cors_urls
+    global admission
+    global typeahead
 
     # Load everything from the config file
     try:
         client_id_file = Path(*config_data['client_id_file'])
         client_secret_file = Path(*config_data['client_secret_file'])
+        admin_token_file = Path(*config_data['admin_token_file'])
         redirect_uri = config_data['redirect_uri']
         db_file = Path(*config_data['database_file'])
         create_db = config_data['create_database_if_missing']
         cors_urls = config_data['cors_urls']
+        write_flush_interval = config_data['write_flush_interval']
+        write_batch_size = config_data['write_batch_size']
+        admission = config_data['admission']
+        typeahead = config_data['typeahead']
     except KeyError as e:
         raise KeyError(f'Missing key "{e}" from config file "{config_file}"')
 
@@ -63,6 +90,9 @@ def __setup__(config_file: Path) -> None:
     client_id = client_id_file.read_text()
     client_secret = client_secret_file.read_text()
 
+    # The admin endpoints are optional, so a missing or empty token file just turns them off
+    admin_token = (admin_token_file.read_text().strip() or None) if admin_token_file.exists() else None
+
     # Encode the client ID and secret into a base64 string
     auth_header = f'Basic {base64.b64encode(f"{client_id}:{client_secret}".encode("ascii")).decode("ascii")}'
 
@@ -75,7 +105,7 @@ def __setup__(config_file: Path) -> None:
         db.row_factory = sqlite3.Row
         # Check if the tables exist in the database. Currently, we only check that tables with the correct names exist,
         # and don't bother to validate if the tables are configured correctly. This will likely change in the future.
-        for table in ['users', 'playlists', 'rules']:
+        for table in ['users', 'playlists', 'rules', 'snapshots']:
             # If a table exists in the database, it will have an entry in the `sqlite_master` table.
             reply = db.execute(f"SELECT EXISTS(SELECT true FROM sqlite_master WHERE name = '{table}' AND type = 'table')")
             if not reply.fetchone()[0]:
@@ -125,7 +155,19 @@ def __setup__(config_file: Path) -> None:
                 exec_order INT  not null
             );
         ''')
+
+        db.execute('''
+            create table if not exists snapshots(
+                source   TEXT not null
+                    constraint snapshot_pk
+                        primary key on conflict replace,
+                data     BLOB not null,
+                built_at INT  not null
+            );
+        ''')
         db.commit()
 
+    writes = WriteBehind(db, write_batch_size)
+
 
 __setup__(Path("cfg", "cfg.yml"))
@@ -0,0 +1,55 @@
+from typing import Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+# Spotify identifies markets by their ISO 3166-1 alpha-2 country code. Every possible two letter code is given a fixed
+# bit position (AA = 0, AB = 1, ... ZZ = 675), so the list of markets an item can be played in can be packed into a
+# single int. Because the positions are derived from the codes themselves, masks stay valid if they are stored and
+# loaded again later, even if Spotify opens new markets in the meantime.
+def bit(market: str) -> int:
+    """
+    Get the bit that represents a market in an availability mask
+    :param market: ISO 3166-1 alpha-2 country code of the market (case-insensitive)
+    :return: An int with only the bit for `market` set
+    """
+    code = market.upper()
+    if len(code) != 2 or not ("A" <= code[0] <= "Z" and "A" <= code[1] <= "Z"):
+        raise ValueError(f'"{market}" is not a valid ISO 3166-1 alpha-2 country code')
+    return 1 << ((ord(code[0]) - ord("A")) * 26 + ord(code[1]) - ord("A"))
+
+
+def mask(markets: Iterable[str] | None) -> int:
+    """
+    Pack a list of markets into an availability mask
+    :param markets: The `available_markets` list of a Spotify object. May be `None`.
+    :return: An int with the bit for every market in `markets` set
+    """
+    result = 0
+    for market in markets or ():
+        result |= bit(market)
+    return result
+
+
+def is_available(item_mask: int, market: str) -> bool:
+    """
+    Check if an item can be played in a market
+    :param item_mask: Availability mask of the item, as created by `mask`
+    :param market: ISO 3166-1 alpha-2 country code of the market
+    :return: True if the item can be played in `market`
+    """
+    return bool(item_mask & bit(market))
+
+
+def filter_available(items: Iterable[T], masks: Iterable[int], market: str | None) -> list[T]:
+    """
+    Filter a batch of items down to the ones that can be played in a market
+    :param items: Items to filter
+    :param masks: Availability mask of each item, in the same order as `items`
+    :param market: ISO 3166-1 alpha-2 country code of the market. If `None`, nothing is filtered out.
+    :return: Every item in `items` that can be played in `market`, in their original order
+    """
+    if market is None:
+        return list(items)
+    market_bit = bit(market)
+    return [item for item, item_mask in zip(items, masks) if item_mask & market_bit]
@@ -1,3 +1,4 @@
+from models.admission_stats import AdmissionStats
 from models.album import Album
 from models.album_type import AlbumType
 from models.auth import Auth
@@ -9,3 +10,4 @@ from models.search_type import SearchType
 from models.spotify_playlist import SpotifyPlaylist
 from models.spotify_user import SpotifyUser
 from models.track import Track
+from models.typeahead_item import TypeaheadItem
@@ -0,0 +1,14 @@
+from pydantic import BaseModel, Field
+
+
+class AdmissionStats(BaseModel):
+    in_flight: int = Field(description="Number of requests currently running.")
+    waiting: int = Field(description="Number of requests currently waiting for a free slot.")
+    admitted: int = Field(description="Number of requests that have been allowed to run.")
+    rejected_user: int = Field(description="Number of requests rejected with a 429 because the user had "
+                                           "too many requests running or waiting.")
+    rejected_queue_full: int = Field(description="Number of requests rejected with a 503 because the queue was full.")
+    rejected_timeout: int = Field(description="Number of requests rejected with a 503 because no slot "
+                                              "was freed before they timed out.")
+    queue_time_total: float = Field(description="Total seconds admitted requests spent waiting for a slot.")
+    queue_time_max: float = Field(description="Longest time in seconds an admitted request waited for a slot.")
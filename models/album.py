@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
+import markets
 from models.spotify_user import SpotifyUser
 from models.album_type import AlbumType
 
@@ -21,11 +22,18 @@ class Album(BaseModel):
                                                       "relationship of the author to the album. Otherwise, is `Null`.")
     artists: list[SpotifyUser] = Field(description="A list of artists credited with working on this album.")
 
+    # Availability mask built from `available_markets`, see `Track._market_mask`
+    _market_mask: int = PrivateAttr(default=0)
+
+    def available_in(self, market: str) -> bool:
+        return markets.is_available(self._market_mask, market)
+
     @staticmethod
     def from_raw(raw: dict):
-        return Album(
+        album = Album(
                 album_type=AlbumType(raw.get('album_type')),
                 total_tracks=raw.get('total_tracks'),
+                available_markets=raw.get('available_markets', []),
                 spotify_url=raw.get('external_urls').get('spotify'),
                 spotify_id=raw.get('id'),
                 images=[i.get('url') for i in raw.get('images')],
@@ -33,5 +41,8 @@ class Album(BaseModel):
                 release_date=raw.get('release_date'),
                 genres=raw.get('genres', []),
                 popularity=raw.get('popularity'),
+                album_group=raw.get('album_group'),
                 artists=[SpotifyUser.from_raw(i) for i in raw.get('artists')]
                 )
+        album._market_mask = markets.mask(album.available_markets)
+        return album
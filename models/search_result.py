@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 
+import markets
 from models.track import Track
 from models.spotify_playlist import SpotifyPlaylist
 from models.album import Album
@@ -19,4 +20,18 @@ class SearchResult(BaseModel):
                 playlists=[SpotifyPlaylist.from_raw(i) for i in raw.get("playlists").get("items")] if raw.get("playlists") else None,
                 albums=[Album.from_raw(i) for i in raw.get("albums").get("items")] if raw.get("albums") else None,
                 artists=[Artist.from_raw(i) for i in raw.get("artists").get("items")] if raw.get("artists") else None
-                )
\ No newline at end of file
+                )
+
+    def available_in(self, market: str):
+        """
+        Drop every track and album that can't be played in a market. Playlists and artists aren't tied to a market,
+        so they are left as-is.
+        :param market: ISO 3166-1 alpha-2 country code of the market
+        :return: A new SearchResult with only the playable tracks and albums
+        """
+        return SearchResult(
+                tracks=markets.filter_available(self.tracks, (i._market_mask for i in self.tracks), market) if self.tracks is not None else None,
+                playlists=self.playlists,
+                albums=markets.filter_available(self.albums, (i._market_mask for i in self.albums), market) if self.albums is not None else None,
+                artists=self.artists
+                )
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
+import markets
 from models.album import Album
 from models.spotify_user import SpotifyUser
 
@@ -24,9 +25,16 @@ class Track(BaseModel):
                                           "the track number is the number on the specified disc.")
     is_local: bool = Field(description="`true` if the track is a local file instead of a Spotify song.")
 
+    # Availability mask built from `available_markets`, so checking if the track is playable in a market is one bitwise
+    # and instead of a scan of the list.
+    _market_mask: int = PrivateAttr(default=0)
+
+    def available_in(self, market: str) -> bool:
+        return markets.is_available(self._market_mask, market)
+
     @staticmethod
     def from_raw(raw: dict):
-        return Track(
+        track = Track(
                 album=Album.from_raw(raw.get('album')),
                 artists=[SpotifyUser.from_raw(i) for i in raw.get('artists')],
                 available_markets=raw.get('available_markets'),
@@ -41,3 +49,5 @@ class Track(BaseModel):
                 track_number=raw.get('track_number'),
                 is_local=raw.get('is_local')
                 )
+        track._market_mask = markets.mask(track.available_markets)
+        return track
@@ -0,0 +1,22 @@
+from pydantic import BaseModel, Field
+
+from models.search_type import SearchType
+
+
+class TypeaheadItem(BaseModel):
+    spotify_id: str = Field(title="Spotify ID", description="ID that can be used to access the item from the API.")
+    name: str = Field(description="The name of the item.")
+    type: SearchType = Field(description="The type of the item.")
+    image: str | None = Field(description="The smallest thumbnail image of the item. May be `null` if it has none.")
+
+    @staticmethod
+    def from_raw(raw: dict):
+        # Tracks don't have their own images, so use the album art instead
+        images = raw.get('images') if raw.get('type') != SearchType.track else raw.get('album').get('images')
+        return TypeaheadItem(
+                spotify_id=raw.get('id'),
+                name=raw.get('name'),
+                type=SearchType(raw.get('type')),
+                # Images are returned by size in descending order
+                image=images[-1].get('url') if images else None
+                )
@@ -0,0 +1,176 @@
+import cProfile
+import logging
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from enum import Enum
+
+
+class ProfileMode(str, Enum):
+    sample = "sample"
+    cprofile = "cprofile"
+    tracemalloc = "tracemalloc"
+
+
+class Session:
+    """
+    Profiles a fraction of the requests to a route. Only one request is profiled at a time, as every mode measures the
+    whole event loop thread and overlapping requests would be counted twice.
+
+    - `sample`: a background thread records the event loop thread's stack every `interval` seconds, exported as
+      collapsed stacks for flame graph tools
+    - `cprofile`: runs `cProfile` around each request, exported as a pstats file
+    - `tracemalloc`: compares tracemalloc snapshots from before and after each request, exported as the lines that
+      allocated the most memory
+    """
+    mode: ProfileMode
+    route: str | None
+    fraction: float
+    interval: float
+    requests: int
+    busy: bool
+
+    def __init__(self, mode: ProfileMode, route: str | None, fraction: float, interval: float) -> None:
+        """
+        :param mode: How requests are profiled
+        :param route: Only profile requests whose path starts with this. If `None`, profile every route.
+        :param fraction: Fraction of matching requests to profile, between 0 and 1
+        :param interval: Seconds between stack samples. Only used in `sample` mode.
+        """
+        self.mode = mode
+        self.route = route
+        self.fraction = fraction
+        self.interval = interval
+        self.requests = 0
+        self.busy = False
+        self.running = True
+
+        self.stacks: Counter[str] = Counter()
+        # `stacks` is written by the sampler thread and read by `export` on the event loop thread
+        self.stacks_lock = threading.Lock()
+        self.stats: pstats.Stats | None = None
+        self.allocations: Counter[str] = Counter()
+
+        if mode == ProfileMode.sample:
+            self.thread_id = threading.get_ident()
+            threading.Thread(target=self.sample, daemon=True).start()
+        if mode == ProfileMode.tracemalloc:
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.mode == ProfileMode.tracemalloc:
+            tracemalloc.stop()
+
+    def wants(self, path: str) -> bool:
+        """
+        Decide if a request should be profiled
+        :param path: Path of the request
+        """
+        if self.busy or path.startswith("/admin"):
+            return False
+        if self.route is not None and not path.startswith(self.route):
+            return False
+        return random.random() < self.fraction
+
+    async def profile(self, request) -> None:
+        """
+        Run a request under the profiler
+        :param request: Awaitable that handles the request
+        """
+        self.busy = True
+        self.requests += 1
+        try:
+            if self.mode == ProfileMode.cprofile:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    await request
+                finally:
+                    profiler.disable()
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profiler)
+                    else:
+                        self.stats.add(profiler)
+            elif self.mode == ProfileMode.tracemalloc:
+                before = tracemalloc.take_snapshot()
+                try:
+                    await request
+                finally:
+                    # Tracing stops if the session is stopped while the request is running
+                    if tracemalloc.is_tracing():
+                        for stat in tracemalloc.take_snapshot().compare_to(before, "lineno"):
+                            self.allocations[str(stat.traceback)] += stat.size_diff
+            else:
+                await request
+        finally:
+            self.busy = False
+
+    def sample(self) -> None:
+        while self.running:
+            time.sleep(self.interval)
+            if not self.busy:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            with self.stacks_lock:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def export(self) -> bytes:
+        """
+        :return: The results so far, in the format of the session's mode
+        """
+        if self.mode == ProfileMode.cprofile:
+            # The pstats file format is just the marshalled stats dict, see `pstats.Stats.dump_stats`
+            return marshal.dumps(self.stats.stats) if self.stats else b""
+        if self.mode == ProfileMode.tracemalloc:
+            return "".join(f"{line} {size}\n" for line, size in self.allocations.most_common(100)).encode()
+        with self.stacks_lock:
+            stacks = list(self.stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks).encode()
+
+
+# The running profiling session, if any. Kept as `None` while profiling is off, so unprofiled requests pay for nothing
+# but a single check.
+active: Session | None = None
+
+# The last session that was started, kept after it stops so its results can still be exported
+last: Session | None = None
+
+
+def start(mode: ProfileMode, route: str | None, fraction: float, interval: float) -> None:
+    global active, last
+    stop()
+    logging.info(f"starting {mode.value} profiling of {route or 'all routes'} ({fraction:.0%} of requests)")
+    active = last = Session(mode, route, fraction, interval)
+
+
+def stop() -> None:
+    global active
+    if active:
+        logging.info(f"stopping {active.mode.value} profiling after {active.requests} requests")
+        active.stop()
+        active = None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that hands requests to the active profiling session
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if active is None or scope["type"] != "http" or not active.wants(scope["path"]):
+            return await self.app(scope, receive, send)
+        await active.profile(self.app(scope, receive, send))
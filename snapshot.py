@@ -0,0 +1,99 @@
+import json
+import time
+import zlib
+
+import cfg
+import markets
+
+
+# The groups Spotify sorts an artist's albums into, in the order they appear in the playlist
+ALBUM_GROUPS = ["album", "single", "compilation", "appears_on"]
+
+
+class Snapshot:
+    """
+    The results of a previous playlist build, saved so the next build only needs to fetch albums released since then.
+    """
+    source: str
+    groups: dict[str, list[str]]
+    tracks: dict[str, list[tuple[str, int]]]
+    built_at: float
+
+    def __init__(self, source: str, groups: dict[str, list[str]] = None,
+                 tracks: dict[str, list[tuple[str, int]]] = None, built_at: float = None) -> None:
+        """
+        :param source: What the playlist was built from, e.g. the Spotify ID of the artist
+        :param groups: IDs of the albums in each album group, in the order Spotify lists them (newest first)
+        :param tracks: For each album, the URI and availability mask of every track that made it into the playlist
+        :param built_at: Time the snapshot was built at
+        """
+        self.source = source
+        self.groups = groups if groups is not None else {}
+        self.tracks = tracks if tracks is not None else {}
+        self.built_at = built_at
+
+    @property
+    def albums(self) -> list[str]:
+        """
+        IDs of every album in the snapshot, in the order their tracks appear in the playlist
+        """
+        return [album for group in ALBUM_GROUPS for album in self.groups.get(group, [])]
+
+    @staticmethod
+    def load(source: str):
+        """
+        Get the snapshot of the last build of a source from the database
+        :param source: What the playlist was built from, e.g. the Spotify ID of the artist
+        :return: The snapshot, or `None` if the source has never been built
+        """
+        cfg.writes.apply()
+        row = cfg.db.execute("SELECT * FROM snapshots WHERE source = ?", (source,)).fetchone()
+        if not row:
+            return None
+
+        data = json.loads(zlib.decompress(row["data"]))
+        # Snapshots saved before albums were tracked by group can't be updated incrementally, so rebuild from scratch
+        if "groups" not in data:
+            return None
+
+        # Most tracks share the same handful of availability masks, so each distinct mask is only stored once and
+        # tracks refer to it by index.
+        masks = [int(i, 16) for i in data["masks"]]
+        tracks = {album: [(uri, masks[mask]) for uri, mask in items] for album, items in data["tracks"].items()}
+        return Snapshot(source, data["groups"], tracks, row["built_at"])
+
+    def save(self) -> None:
+        """
+        Write the snapshot to the database, replacing the previous snapshot of the same source
+        """
+        self.built_at = time.time()
+
+        masks: dict[int, int] = {}
+        tracks = {album: [[uri, masks.setdefault(mask, len(masks))] for uri, mask in items]
+                  for album, items in self.tracks.items()}
+        data = {"groups": self.groups, "tracks": tracks, "masks": [format(i, "x") for i in masks]}
+
+        # A lost snapshot only means the next build starts from scratch, so it doesn't need its own commit
+        cfg.writes.defer(
+            "INSERT INTO snapshots (source, data, built_at) VALUES (?, ?, ?)",
+            (self.source, zlib.compress(json.dumps(data, separators=(",", ":")).encode()), self.built_at)
+            )
+
+    def set_group(self, group: str, albums: list[str]) -> None:
+        """
+        Replace the albums listed in a group, dropping the tracks of any album that is no longer listed anywhere
+        :param group: The album group
+        :param albums: IDs of every album Spotify lists in the group, in the order it lists them
+        """
+        self.groups[group] = albums
+        listed = set(self.albums)
+        self.tracks = {album: items for album, items in self.tracks.items() if album in listed}
+
+    def uris(self, market: str = None) -> list[str]:
+        """
+        Get the final, ordered tracklist of the build
+        :param market: ISO 3166-1 alpha-2 country code. If given, tracks that can't be played in it are left out.
+        :return: URIs of every track in the playlist
+        """
+        items = [item for album in self.albums for item in self.tracks.get(album, [])]
+        return markets.filter_available((i[0] for i in items), (i[1] for i in items), market)
@@ -0,0 +1,88 @@
+"""
+Measures database write throughput under a storm of token refreshes, committing every write (how `User.refresh` used to
+work) against deferring them through `WriteBehind`. Run from the repository root with `python tests/bench_writes.py`.
+"""
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from writes import WriteBehind  # noqa: E402
+
+USERS = 100
+# Refreshes per second during the storm, and how long it lasts. The storm spans several flush windows, so the write-behind
+# numbers include its periodic commits and not just one final flush.
+RATE = 2000
+DURATION = 5.0
+# A request loads a `User` (and so applies the deferred writes) between every this many refreshes
+READ_EVERY = 10
+FLUSH_INTERVAL = 1.0
+BATCH_SIZE = 500
+UPDATE = "UPDATE users SET access_token = ?, expires_at = ? WHERE spotify_id = ?"
+
+
+def make_db(path: Path) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute("create table users(spotify_id TEXT primary key, access_token TEXT not null, expires_at INT not null)")
+    db.executemany("INSERT INTO users VALUES (?, ?, ?)", [(f"user{i}", "token", 0) for i in range(USERS)])
+    db.commit()
+    return db
+
+
+def commit_each(db: sqlite3.Connection):
+    def refresh(i: int) -> None:
+        db.execute(UPDATE, (f"token{i}", i, f"user{i % USERS}"))
+        db.commit()
+
+    return refresh, lambda: None
+
+
+def write_behind(db: sqlite3.Connection):
+    writes = WriteBehind(db, BATCH_SIZE)
+
+    def refresh(i: int) -> None:
+        writes.defer(UPDATE, (f"token{i}", i, f"user{i % USERS}"))
+        if i % READ_EVERY == 0:
+            writes.apply()
+
+    return refresh, writes.flush
+
+
+def storm(refresh, flush) -> tuple[int, float, float]:
+    """
+    Send refreshes at `RATE` for `DURATION` seconds, flushing every `FLUSH_INTERVAL` like the app's flush loop
+    :return: Number of refreshes sent, seconds spent writing, and seconds the storm took. A setup that can't keep up
+        sends fewer refreshes and overruns the storm.
+    """
+    count = 0
+    busy = 0.0
+    start = last_flush = time.perf_counter()
+    while (now := time.perf_counter()) - start < DURATION:
+        due = int((now - start) * RATE)
+        before = time.perf_counter()
+        while count < due:
+            refresh(count)
+            count += 1
+        if now - last_flush >= FLUSH_INTERVAL:
+            flush()
+            last_flush = now
+        busy += time.perf_counter() - before
+        time.sleep(0.001)
+    before = time.perf_counter()
+    flush()
+    busy += time.perf_counter() - before
+    return count, busy, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        for name, make in [("commit each write", commit_each), ("write-behind", write_behind)]:
+            db = make_db(Path(directory, f"{make.__name__}.db"))
+            count, busy, elapsed = storm(*make(db))
+            db.close()
+            # The storm is paced, so what matters is how much of the time goes to writing rather than the wall time
+            print(f"{name}: {count:,} of {int(RATE * DURATION):,} writes in {elapsed:.1f}s, {busy:.2f}s spent writing "
+                  f"({busy / elapsed:.0%} of the event loop), {count / busy:,.0f} writes/s")
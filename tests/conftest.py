@@ -0,0 +1,21 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# `cfg` loads the config file and database relative to the working directory as soon as it is imported, so give it a
+# scratch copy of the config with dummy credentials before any test imports it.
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root))
+
+scratch = Path(tempfile.mkdtemp())
+(scratch / "cfg").mkdir()
+shutil.copy(root / "cfg" / "cfg.yml", scratch / "cfg" / "cfg.yml")
+(scratch / "cfg" / "client_id").write_text("client_id")
+(scratch / "cfg" / "client_secret").write_text("client_secret")
+
+cwd = os.getcwd()
+os.chdir(scratch)
+import cfg  # noqa: E402
+os.chdir(cwd)
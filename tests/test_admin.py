@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import cfg
+import profiling
+import SpotList
+
+
+@pytest.mark.parametrize("configured, sent", [(None, None), (None, ""), ("admin", None), ("admin", ""), ("admin", "x")])
+def test_admin_only_rejects(monkeypatch, configured, sent):
+    monkeypatch.setattr(cfg, "admin_token", configured)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(SpotList.admin_only(sent))
+    assert error.value.status_code == 403
+
+
+def test_admin_only_accepts_correct_token(monkeypatch):
+    monkeypatch.setattr(cfg, "admin_token", "admin")
+    asyncio.run(SpotList.admin_only("admin"))
+
+
+def test_export_while_sampling():
+    session = profiling.Session(profiling.ProfileMode.sample, None, 1, 0.0001)
+    session.busy = True
+    try:
+        # Exporting must not race the sampler thread adding new stacks
+        deadline = time.time() + 0.5
+        while time.time() < deadline:
+            session.export()
+    finally:
+        session.busy = False
+        session.stop()
+    assert session.stacks
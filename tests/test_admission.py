@@ -0,0 +1,117 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import admission
+import cfg
+import SpotList
+from user import AuthorizationException, User
+
+
+def test_limits_and_rejections():
+    async def run():
+        controller = admission.AdmissionController("test", per_user=1, global_limit=1, queue_size=1, timeout=0.1,
+                                                   retry_after=3)
+        await controller.acquire("a")
+
+        with pytest.raises(HTTPException) as error:
+            await controller.acquire("a")
+        assert error.value.status_code == 429
+        assert error.value.headers == {"Retry-After": "3"}
+
+        queued = asyncio.create_task(controller.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as error:
+            await controller.acquire("c")
+        assert error.value.status_code == 503
+
+        await controller.release("a")
+        await queued
+        with pytest.raises(HTTPException) as error:
+            await controller.acquire("d")
+        assert error.value.status_code == 503
+
+        stats = controller.stats()
+        assert (stats.admitted, stats.rejected_user, stats.rejected_queue_full, stats.rejected_timeout) == (2, 1, 1, 1)
+        assert controller.users == {"b": 1}
+
+    asyncio.run(run())
+
+
+def test_unauthenticated_request_takes_no_slot():
+    cfg.writes.commit("INSERT INTO users VALUES ('victim', 'Victim', 'access', 'refresh', 0, 'secret')")
+    controller = admission.controllers["build"]
+    dependency = admission.limit("build")
+
+    async def run():
+        with pytest.raises(AuthorizationException):
+            await dependency("victim", "wrong").__anext__()
+        assert "victim" not in controller.users
+
+        slot = dependency("victim", "secret")
+        user = await slot.__anext__()
+        assert user.spotify_id == "victim"
+        assert controller.users["victim"] == 1
+        await slot.aclose()
+        assert "victim" not in controller.users
+
+    asyncio.run(run())
+
+
+async def build(user_id: str) -> int:
+    """
+    Send a playlist build straight to the ASGI app
+    :return: The response's status code
+    """
+    messages = []
+    body = json.dumps({"name": "Playlist"}).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    headers = [(b"user-id", user_id.encode()), (b"token", b"secret"), (b"content-type", b"application/json"),
+               (b"content-length", str(len(body)).encode())]
+    scope = {"type": "http", "method": "POST", "path": "/temp/from_artist", "raw_path": b"/temp/from_artist",
+             "root_path": "", "query_string": b"artist_id=artist&rebuild=true", "headers": headers,
+             "http_version": "1.1", "scheme": "http", "server": ("test", 80), "client": ("test", 1)}
+    await SpotList.app(scope, receive, send)
+    return messages[0]["status"]
+
+
+def test_concurrent_builds_are_limited(monkeypatch):
+    for user_id in ["builder", "other_builder"]:
+        cfg.writes.commit("INSERT INTO users VALUES (?, ?, 'access', 'refresh', ?, 'secret')",
+                          (user_id, user_id, time.time() + 3600))
+
+    def get(self, endpoint, params=None, body=None, raw_url=False):
+        time.sleep(0.2)
+        return {"items": [], "total": 0, "next": None}
+
+    def post(self, endpoint, params=None, body=None, raw_url=False):
+        return {"id": "playlist", "external_urls": {"spotify": "url"}}
+
+    monkeypatch.setattr(User, "get", get)
+    monkeypatch.setattr(User, "post", post)
+    controller = admission.controllers["build"]
+    monkeypatch.setattr(controller, "per_user", 1)
+    monkeypatch.setattr(controller, "global_limit", 1)
+
+    async def run():
+        first = asyncio.create_task(build("builder"))
+        await asyncio.sleep(0.05)
+        # The first build calls Spotify off the event loop, so other requests are admitted (or not) while it runs
+        assert await build("builder") == 429
+        queued = asyncio.create_task(build("other_builder"))
+        await asyncio.sleep(0.05)
+        assert controller.waiting == 1
+        return await first, await queued
+
+    queue_time_max = controller.queue_time_max
+    assert asyncio.run(run()) == (201, 201)
+    assert controller.queue_time_max > max(queue_time_max, 0.1)
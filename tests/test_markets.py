@@ -0,0 +1,71 @@
+import pytest
+
+import markets
+from models import SearchResult
+
+USER = {'external_urls': {'spotify': 'url'}, 'id': 'artist', 'name': 'Artist'}
+
+
+def album(spotify_id: str, available_markets: list[str]) -> dict:
+    return {'album_type': 'album', 'total_tracks': 1, 'available_markets': available_markets,
+            'external_urls': {'spotify': 'url'}, 'id': spotify_id, 'images': [], 'name': spotify_id,
+            'release_date': '2020', 'artists': [USER]}
+
+
+def track(spotify_id: str, available_markets: list[str]) -> dict:
+    return {'album': album('album', ['US']), 'artists': [USER], 'available_markets': available_markets,
+            'disc_number': 1, 'duration_ms': 1000, 'explicit': False, 'external_urls': {'spotify': 'url'},
+            'id': spotify_id, 'name': spotify_id, 'popularity': '50', 'preview_url': None, 'track_number': 1,
+            'is_local': False}
+
+
+def test_bit_is_case_insensitive_and_unique():
+    assert markets.bit("us") == markets.bit("US")
+    assert markets.bit("AA") == 1
+    assert markets.bit("ZZ") == 1 << 675
+    assert len({markets.bit(a + b) for a in "ABZ" for b in "ABZ"}) == 9
+
+
+@pytest.mark.parametrize("code", ["", "U", "USA", "U1", "1U", "ÜS"])
+def test_bit_rejects_invalid_codes(code):
+    with pytest.raises(ValueError):
+        markets.bit(code)
+
+
+def test_mask():
+    assert markets.mask(None) == 0
+    assert markets.mask([]) == 0
+    assert markets.mask(["US", "de"]) == markets.bit("US") | markets.bit("DE")
+    assert markets.is_available(markets.mask(["US", "DE"]), "de")
+    assert not markets.is_available(markets.mask(["US", "DE"]), "GB")
+
+
+def test_filter_available_keeps_order():
+    items = ["a", "b", "c", "d"]
+    masks = [markets.mask(["US"]), markets.mask(["DE"]), markets.mask(["US", "DE"]), 0]
+    assert markets.filter_available(items, masks, "US") == ["a", "c"]
+    assert markets.filter_available(items, masks, "de") == ["b", "c"]
+
+
+def test_filter_available_without_market_keeps_everything():
+    assert markets.filter_available(["a", "b"], [0, 0], None) == ["a", "b"]
+
+
+def test_search_result_available_in():
+    playlist = {'collaborative': False, 'description': None, 'external_urls': {'spotify': 'url'}, 'id': 'playlist',
+                'images': [], 'name': 'playlist', 'public': True, 'tracks': {'total': 1}, 'owner': USER}
+    artist = {'external_urls': {'spotify': 'url'}, 'id': 'artist', 'name': 'Artist', 'followers': {'total': 1},
+              'genres': [], 'popularity': 1, 'images': []}
+    result = SearchResult.from_raw({
+        'tracks': {'items': [track('us_only', ['US']), track('both', ['US', 'DE'])]},
+        'albums': {'items': [album('de_only', ['DE']), album('none', [])]},
+        'playlists': {'items': [playlist]},
+        'artists': {'items': [artist]}
+        })
+
+    filtered = result.available_in("DE")
+    assert [i.spotify_id for i in filtered.tracks] == ["both"]
+    assert [i.spotify_id for i in filtered.albums] == ["de_only"]
+    assert filtered.playlists == result.playlists
+    assert filtered.artists == result.artists
+    assert result.tracks[0].available_in("us") and not result.tracks[0].available_in("DE")
@@ -0,0 +1,100 @@
+import SpotList
+from snapshot import Snapshot
+
+
+class FakeArtist:
+    """
+    Stands in for a `User`, answering the API calls a build makes for an artist's catalogue
+    """
+
+    def __init__(self, groups: dict[str, list[str]]) -> None:
+        self.groups = groups
+        self.calls: list[str] = []
+
+    def get(self, endpoint: str, params: dict = None, body: dict = None, raw_url: bool = False) -> dict:
+        self.calls.append(endpoint)
+        if endpoint == "/albums":
+            return {"albums": [self.album(i) for i in params["ids"].split(",")]}
+        if raw_url:
+            group, offset = endpoint.split(":")
+        else:
+            group, offset = params["include_groups"], 0
+        albums = self.groups.get(group, [])
+        offset = int(offset)
+        return {"items": [{"id": i} for i in albums[offset:offset + 50]],
+                "total": len(albums),
+                "next": f"{group}:{offset + 50}" if offset + 50 < len(albums) else None}
+
+    @staticmethod
+    def album(album_id: str) -> dict:
+        tracks = [{"uri": f"spotify:track:{album_id}", "artists": [{"id": "artist"}], "available_markets": ["US"]},
+                  {"uri": f"spotify:track:{album_id}-guest", "artists": [{"id": "other"}], "available_markets": ["US"]}]
+        return {"id": album_id, "tracks": {"items": tracks, "next": None}}
+
+
+def build(artist: FakeArtist, snapshot: Snapshot = None) -> Snapshot:
+    snapshot = snapshot or Snapshot("artist:artist")
+    SpotList.update_artist_snapshot(artist, "artist", snapshot)
+    return snapshot
+
+
+def expected(groups: dict[str, list[str]]) -> list[str]:
+    return [f"spotify:track:{i}" for group in ["album", "single", "compilation", "appears_on"]
+            for i in groups.get(group, [])]
+
+
+def test_save_and_load_round_trip():
+    snapshot = Snapshot("artist:round_trip", {"album": ["a", "b"], "single": ["c"]},
+                        {"a": [("spotify:track:1", 1 << 600)], "b": [("spotify:track:2", 3)], "c": []})
+    snapshot.save()
+
+    loaded = Snapshot.load("artist:round_trip")
+    assert loaded.groups == snapshot.groups
+    assert loaded.tracks == snapshot.tracks
+    assert loaded.albums == ["a", "b", "c"]
+    assert Snapshot.load("artist:missing") is None
+
+
+def test_set_group_drops_delisted_albums():
+    snapshot = Snapshot("artist:set_group", {"album": ["a", "b"], "single": ["c"]},
+                        {"a": [("1", 0)], "b": [("2", 0)], "c": [("3", 0)]})
+    snapshot.set_group("album", ["new", "a"])
+
+    assert snapshot.albums == ["new", "a", "c"]
+    assert set(snapshot.tracks) == {"a", "c"}
+
+
+def test_warm_build_matches_cold_build():
+    groups = {"album": [f"al{i}" for i in range(60)], "single": [f"s{i}" for i in range(5)]}
+    snapshot = build(FakeArtist(groups))
+    assert snapshot.uris() == expected(groups)
+
+    groups["single"].insert(0, "s_new")
+    groups["album"].insert(0, "al_new")
+    artist = FakeArtist(groups)
+    warm = build(artist, snapshot)
+
+    assert warm.uris() == build(FakeArtist(groups)).uris() == expected(groups)
+    # One page per album group, plus one /albums call for the two new releases
+    assert len(artist.calls) == 5
+
+
+def test_warm_build_handles_delisted_albums():
+    groups = {"album": [f"alb{i}" for i in range(120)]}
+    snapshot = build(FakeArtist(groups))
+
+    groups["album"].remove("alb5")
+    groups["single"] = ["new_single"]
+    warm = build(FakeArtist(groups), snapshot)
+
+    assert warm.uris() == expected(groups)
+    assert "alb5" not in warm.tracks
+
+
+def test_unchanged_artist_only_lists_albums():
+    groups = {"album": [f"al{i}" for i in range(300)], "single": ["s0"]}
+    snapshot = build(FakeArtist(groups))
+
+    artist = FakeArtist(groups)
+    build(artist, snapshot)
+    assert len(artist.calls) == 4
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import time
+
+import admission
+import cfg
+import SpotList
+import typeahead
+from user import User
+
+cfg.writes.commit("INSERT INTO users VALUES ('typist', 'Typist', 'access', 'refresh', ?, 'secret')", (time.time() + 3600,))
+
+
+async def call(path: str, query: str) -> tuple[int, bytes]:
+    """
+    Send a GET request straight to the ASGI app
+    """
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": query.encode(), "headers": [(b"user-id", b"typist"), (b"token", b"secret")],
+             "http_version": "1.1", "scheme": "http", "server": ("test", 80), "client": ("test", 1)}
+    await SpotList.app(scope, receive, send)
+    return messages[0]["status"], b"".join(i.get("body", b"") for i in messages[1:])
+
+
+def test_typing_a_word_only_searches_once(monkeypatch):
+    searches = []
+
+    def get(self, endpoint, params=None, body=None, raw_url=False):
+        searches.append(params["q"])
+        time.sleep(0.05)
+        item = {"id": "1", "name": "Hello", "type": "artist", "images": [{"url": "big"}, {"url": "small"}]}
+        return {"artists": {"items": [item], "total": 50}}
+
+    monkeypatch.setattr(User, "get", get)
+
+    async def type_word(word: str) -> list[tuple[int, bytes]]:
+        requests = []
+        for end in range(1, len(word) + 1):
+            requests.append(asyncio.create_task(call("/search/typeahead", f"types=artist&query={word[:end]}")))
+            await asyncio.sleep(0.03)
+        return await asyncio.gather(*requests)
+
+    responses = asyncio.run(type_word("hello"))
+
+    # Every keystroke but the last is superseded while it waits out the debounce delay, without using up any of the
+    # user's admission slots, so the last keystroke still gets its results.
+    assert [code for code, _ in responses] == [409, 409, 409, 409, 200]
+    assert json.loads(responses[-1][1]) == [{"spotify_id": "1", "name": "Hello", "type": "artist", "image": "small"}]
+    assert searches == ["hello"]
+
+
+def test_superseded_search_holds_its_slot_until_spotify_answers(monkeypatch):
+    def get(self, endpoint, params=None, body=None, raw_url=False):
+        time.sleep(0.5)
+        return {"artists": {"items": [], "total": 50}}
+
+    monkeypatch.setattr(User, "get", get)
+    controller = admission.controllers["search"]
+    monkeypatch.setattr(controller, "per_user", 2)
+
+    async def run() -> list[int]:
+        requests = []
+        for query in ["alpha", "bravo", "charlie"]:
+            requests.append(asyncio.create_task(call("/search/typeahead", f"types=artist&query={query}")))
+            await asyncio.sleep(0.2)
+        codes = [code for code, _ in await asyncio.gather(*requests)]
+        await asyncio.gather(*typeahead.calls)
+        return codes
+
+    # "bravo" supersedes "alpha", but the thread calling Spotify for "alpha" keeps running and keeps its slot, so
+    # "charlie" is over the user's limit
+    assert asyncio.run(run()) == [409, 200, 429]
+    assert "typist" not in controller.users
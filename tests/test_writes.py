@@ -0,0 +1,60 @@
+import sqlite3
+
+from writes import WriteBehind
+
+
+def make_db() -> sqlite3.Connection:
+    db = sqlite3.connect(":memory:")
+    db.execute("create table users(spotify_id TEXT primary key, access_token TEXT not null)")
+    db.execute("insert into users values ('u1', 'old')")
+    db.commit()
+    return db
+
+
+def test_deferred_writes_are_visible_before_commit():
+    db = make_db()
+    writes = WriteBehind(db, 100)
+    writes.defer("UPDATE users SET access_token = ? WHERE spotify_id = ?", ("new", "u1"))
+    writes.apply()
+
+    assert db.execute("SELECT access_token FROM users").fetchone()[0] == "new"
+    assert db.in_transaction
+
+    writes.flush()
+    assert not db.in_transaction
+
+
+def test_failed_write_is_dropped_without_blocking_the_queue():
+    db = make_db()
+    writes = WriteBehind(db, 100)
+    writes.defer("UPDATE users SET access_token = ? WHERE spotify_id = ?", (None, "u1"))
+    writes.defer("INSERT INTO users VALUES (?, ?)", ("u2", "token"))
+    writes.flush()
+
+    # The failed write is gone, so later applies don't keep raising
+    writes.apply()
+    assert writes.pending == {}
+    assert db.execute("SELECT access_token FROM users WHERE spotify_id = 'u1'").fetchone()[0] == "old"
+    assert db.execute("SELECT access_token FROM users WHERE spotify_id = 'u2'").fetchone()[0] == "token"
+
+
+def test_failed_row_does_not_drop_the_rest_of_its_batch():
+    db = make_db()
+    writes = WriteBehind(db, 100)
+    for row in [("u2", "a"), ("u3", None), ("u4", "c")]:
+        writes.defer("INSERT INTO users VALUES (?, ?)", row)
+    writes.flush()
+
+    assert [i[0] for i in db.execute("SELECT spotify_id FROM users ORDER BY spotify_id")] == ["u1", "u2", "u4"]
+
+
+def test_applied_writes_count_towards_the_batch_size():
+    db = make_db()
+    writes = WriteBehind(db, 3)
+    for token in ["a", "b", "c"]:
+        writes.defer("UPDATE users SET access_token = ? WHERE spotify_id = ?", (token, "u1"))
+        # Requests apply the queue all the time, which must not keep the batch from ever filling up
+        writes.apply()
+
+    assert not db.in_transaction
+    assert writes.uncommitted == 0
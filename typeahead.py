@@ -0,0 +1,175 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, status
+
+import admission
+import cfg
+import models
+from user import User
+
+
+def normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def matches(text: str, query: str) -> bool:
+    """
+    Check if every word of a (normalized) query is the start of a word in some text. This approximates how Spotify
+    matches a query against an item's name and artists.
+    """
+    words = text.lower().split()
+    return all(any(word.startswith(i) for word in words) for i in query.split())
+
+
+class PrefixCache:
+    """
+    Typeahead results, keyed by normalized query. A result is complete if Spotify had no more items to return for it.
+    Every item that matches a longer query also matches its prefixes, so a complete result can answer any query that
+    starts with it by filtering it locally, without calling Spotify at all.
+    """
+    size: int
+    ttl: float
+    entries: OrderedDict[tuple, tuple[float, bool, list[tuple[models.TypeaheadItem, str]]]]
+
+    def __init__(self, size: int, ttl: float) -> None:
+        """
+        :param size: Number of results to hold before dropping the least recently used
+        :param ttl: Seconds a result stays valid for
+        """
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key: tuple, query: str) -> list[models.TypeaheadItem] | None:
+        """
+        Find the results for a query, either cached directly or filtered from a complete result of a prefix of it
+        :param key: Everything other than the query that the results depend on (item types, limit, etc.)
+        :param query: The normalized query
+        :return: The results, or `None` if they aren't cached
+        """
+        now = time.time()
+        for end in range(len(query), 0, -1):
+            entry = self.entries.get((key, query[:end]))
+            if not entry:
+                continue
+            created, complete, items = entry
+            if now - created > self.ttl:
+                del self.entries[(key, query[:end])]
+                continue
+            if end == len(query):
+                self.entries.move_to_end((key, query))
+                return [item for item, _ in items]
+            if complete:
+                self.entries.move_to_end((key, query[:end]))
+                return [item for item, text in items if matches(text, query)]
+        return None
+
+    def put(self, key: tuple, query: str, complete: bool, items: list[tuple[models.TypeaheadItem, str]]) -> None:
+        """
+        :param key: Everything other than the query that the results depend on (item types, limit, etc.)
+        :param query: The normalized query
+        :param complete: True if Spotify had no more items to return for the query
+        :param items: Each result, paired with the text (name, artists) Spotify could have matched it on
+        """
+        self.entries[(key, query)] = (time.time(), complete, items)
+        self.entries.move_to_end((key, query))
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+cache = PrefixCache(cfg.typeahead['cache_size'], cfg.typeahead['cache_ttl'])
+
+# The latest typeahead request of each user, used to drop requests that have been superseded by a newer keystroke
+latest: dict[str, object] = {}
+# Set when the request of each user that is waiting on Spotify gets superseded
+in_flight: dict[str, asyncio.Event] = {}
+# Calls to Spotify that are still running, including ones that nothing waits on anymore
+calls: set[asyncio.Task] = set()
+
+
+async def call(controller: admission.AdmissionController, user: User, params: dict) -> dict:
+    """
+    Search Spotify on a separate thread, then free the admission slot taken for the call. The thread can't be stopped,
+    so the slot is held until it finishes even if the request that started it has been superseded.
+    """
+    try:
+        return await asyncio.to_thread(user.get, "/search", params)
+    finally:
+        await controller.release(user.spotify_id)
+
+
+async def search(user: User, types: list[models.SearchType], query: str, limit: int) -> list[models.TypeaheadItem]:
+    """
+    Search Spotify for items to suggest as the user types. Raises a `HTTPException` with a 409 code if a newer request
+    from the same user comes in before this one finishes.
+    :param user: The user making the request
+    :param types: List of item types to search across
+    :param query: Search query, as typed so far
+    :param limit: The maximum number of results to return for each type
+    :return: The matching items
+    """
+    query = normalize(query)
+    key = (tuple(sorted(types)), limit)
+
+    # Mark this as the user's latest request, superseding any older one that is still waiting out the debounce delay
+    request = latest[user.spotify_id] = object()
+
+    items = cache.get(key, query)
+    if items is not None:
+        del latest[user.spotify_id]
+        return items
+
+    try:
+        # Wait for the user to stop typing. If another keystroke comes in first, it replaces this request and we never
+        # need to call Spotify for it.
+        await asyncio.sleep(cfg.typeahead['debounce'])
+        if latest.get(user.spotify_id) is not request:
+            raise HTTPException(status.HTTP_409_CONFLICT, "superseded by a newer request")
+
+        # Only take an admission slot now that we know we need to call Spotify. From here on, `call` owns the slot.
+        controller = admission.controllers["search"]
+        await controller.acquire(user.spotify_id)
+        try:
+            # The token has to be refreshed here, as the database can't be used from the thread that calls Spotify
+            user.refresh_if_expired(margin=60)
+        except BaseException:
+            await controller.release(user.spotify_id)
+            raise
+        task = asyncio.create_task(call(controller, user, {"type": types, "q": query, "limit": limit}))
+        calls.add(task)
+        task.add_done_callback(calls.discard)
+
+        # Stop waiting on the user's previous request, and wait on this one until it finishes or is superseded in turn
+        if user.spotify_id in in_flight:
+            in_flight[user.spotify_id].set()
+        superseded = in_flight[user.spotify_id] = asyncio.Event()
+        waiter = asyncio.create_task(superseded.wait())
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if in_flight.get(user.spotify_id) is superseded:
+                del in_flight[user.spotify_id]
+    finally:
+        if latest.get(user.spotify_id) is request:
+            del latest[user.spotify_id]
+    if not task.done():
+        raise HTTPException(status.HTTP_409_CONFLICT, "superseded by a newer request")
+    raw = task.result()
+
+    items = []
+    complete = True
+    for search_type in types:
+        results = raw.get(f"{search_type.value}s")
+        if not results:
+            continue
+        found = [i for i in results.get("items") if i]
+        complete = complete and results.get("total") <= len(found)
+        for i in found:
+            text = " ".join([i.get("name")] + [j.get("name") for j in i.get("artists", [])])
+            items.append((models.TypeaheadItem.from_raw(i), text))
+
+    cache.put(key, query, complete, items)
+    return [item for item, _ in items]
@@ -22,7 +22,9 @@ class User:
     app_token: str
 
     def __init__(self, spotify_id: str, token: str) -> None:
-        search = cfg.db.execute(f"SELECT * FROM users where spotify_id = '{spotify_id}' and app_password = '{token}'")
+        # A token refreshed by an earlier request may still be waiting to be written
+        cfg.writes.apply()
+        search = cfg.db.execute("SELECT * FROM users where spotify_id = ? and app_password = ?", (spotify_id, token))
 
         user = search.fetchone()
 
@@ -53,18 +55,31 @@ class User:
         self.access_token = response['access_token']
         self.expires_at = response['expires_in'] + time.time()
 
-        cfg.db.execute(
-            f"""
-            UPDATE users SET 
-                access_token = '{self.access_token}', 
-                expires_at = '{self.expires_at}' 
-            WHERE spotify_id = '{self.spotify_id}'
-            """
-            )
+        # Spotify may issue a new refresh token, in which case the old one stops working. Losing the new one would lock
+        # the user out, so it has to be committed right away. Otherwise, losing the new access token only costs us
+        # another refresh, so the write can wait for the next flush.
+        if response.get('refresh_token'):
+            self.refresh_token = response['refresh_token']
+            cfg.writes.commit(
+                "UPDATE users SET access_token = ?, refresh_token = ?, expires_at = ? WHERE spotify_id = ?",
+                (self.access_token, self.refresh_token, self.expires_at, self.spotify_id)
+                )
+        else:
+            cfg.writes.defer(
+                "UPDATE users SET access_token = ?, expires_at = ? WHERE spotify_id = ?",
+                (self.access_token, self.expires_at, self.spotify_id)
+                )
 
-        cfg.db.commit()
+    def refresh_if_expired(self, margin: float = 0) -> None:
+        """
+        Refresh the access token if it has expired
+        :param margin: Also refresh the token if it will expire within this many seconds
+        """
+        if self.expires_at - margin <= datetime.now(timezone.utc).timestamp():
+            self.refresh()
 
     def get_playlists(self) -> list[models.Playlist]:
+        cfg.writes.apply()
         query = cfg.db.execute(f"SELECT * FROM playlists WHERE owner = '{self.spotify_id}'")
         return [Playlist(**i) for i in query.fetchall()]
 
@@ -80,9 +95,7 @@ class User:
         :return: The JSON response from Spotify, deserialized to a dict
         """
 
-        # If the access token has expired, refresh the token.
-        if self.expires_at <= datetime.now(timezone.utc).timestamp():
-            self.refresh()
+        self.refresh_if_expired()
 
         headers = {'Authorization': f'Bearer {self.access_token}', 'Content-Type': 'application/json'}
         response = requests.request(
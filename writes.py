@@ -0,0 +1,101 @@
+import logging
+import sqlite3
+
+
+class WriteBehind:
+    """
+    Groups database writes that can afford to be lost in a crash into one transaction per flush window, so they don't
+    each pay for a commit. Writes that can't be lost (e.g. anything needed to log a user in) should use `commit`.
+
+    Deferred writes are grouped by statement and run with `executemany`, so a deferred write must not depend on the
+    order it runs in relative to deferred writes using a different statement.
+    """
+    db: sqlite3.Connection
+    batch_size: int
+    pending: dict[str, list[tuple]]
+    pending_count: int
+    uncommitted: int
+
+    def __init__(self, db: sqlite3.Connection, batch_size: int) -> None:
+        """
+        :param db: The connection to write to
+        :param batch_size: Number of deferred writes (queued, or applied but not yet committed) to hold before flushing
+            early, without waiting for the window
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {}
+        self.pending_count = 0
+        # Number of writes that have been applied but not committed yet
+        self.uncommitted = 0
+
+    def defer(self, sql: str, params: tuple = ()) -> None:
+        """
+        Queue a write to be committed with the next flush
+        :param sql: Statement to run. Should use placeholders, so identical statements can be batched together.
+        :param params: Values for the placeholders in `sql`
+        """
+        self.pending.setdefault(sql, []).append(params)
+        self.pending_count += 1
+        # Applied writes count too, as `apply` runs on nearly every request and would otherwise keep resetting the count
+        if self.pending_count + self.uncommitted >= self.batch_size:
+            self.flush()
+
+    def apply(self) -> None:
+        """
+        Run all queued writes without committing them. Must be called before reading anything that a deferred write may
+        have touched - the writes are then visible to `db`, but won't reach the disk until the next commit.
+
+        A write that fails is rolled back, logged and dropped, so it can't block the writes queued after it.
+        """
+        # Take the writes off the queue before running them, so a failure can't leave them queued to fail again
+        pending = self.pending
+        self.uncommitted += self.pending_count
+        self.pending = {}
+        self.pending_count = 0
+
+        if pending and not self.db.in_transaction:
+            self.db.execute("BEGIN")
+        for sql, rows in pending.items():
+            if not self.run(sql, rows):
+                # Retry the rows one by one, so only the ones that actually fail are dropped
+                for row in rows:
+                    if not self.run(sql, [row]):
+                        logging.error(f"dropped deferred write {sql.split()[0]} with {len(row)} parameters")
+
+    def run(self, sql: str, rows: list[tuple]) -> bool:
+        """
+        Run a statement for a batch of rows inside a savepoint, rolling back just that batch if it fails
+        :return: True if the batch succeeded
+        """
+        self.db.execute("SAVEPOINT deferred_write")
+        try:
+            self.db.executemany(sql, rows)
+            return True
+        except sqlite3.Error as e:
+            logging.warning(f"deferred write failed: {e}")
+            self.db.execute("ROLLBACK TO deferred_write")
+            return False
+        finally:
+            self.db.execute("RELEASE deferred_write")
+
+    def flush(self) -> None:
+        """
+        Run and commit all queued writes in a single transaction
+        """
+        self.apply()
+        if self.uncommitted:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def commit(self, sql: str, params: tuple = ()) -> None:
+        """
+        Run and commit a write immediately. Any queued writes run first and are committed with it, so they can't
+        overwrite it later.
+        :param sql: Statement to run
+        :param params: Values for the placeholders in `sql`
+        """
+        self.apply()
+        self.db.execute(sql, params)
+        self.db.commit()
+        self.uncommitted = 0